@@ -1,13 +1,15 @@
 import os
+import stat
 import uuid
 import json
 import logging
 import time
 import asyncio
+import orjson
 from typing import Dict, List, Optional, Union
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
@@ -36,18 +38,29 @@ except ImportError:
             # Fallback to qbittorrent API mode
             lt = None
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
 # Constants
 DOWNLOAD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "downloads"))
 if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
 
+# Map libtorrent torrent states to the status strings used by the API
+STATE_NAMES = {
+    lt.torrent_status.seeding: "seeding",
+    lt.torrent_status.downloading: "downloading",
+    lt.torrent_status.finished: "finished",
+    lt.torrent_status.checking_files: "checking",
+    lt.torrent_status.checking_resume_data: "checking resume",
+} if lt else {}
+
+def is_paused(status) -> bool:
+    """Check the paused flag, which libtorrent keeps outside torrent_status.state"""
+    if hasattr(lt, "torrent_flags"):
+        return bool(status.flags & lt.torrent_flags.paused)  # libtorrent 2.x
+    return status.paused  # libtorrent 1.2
+
 # Initialize FastAPI
-app = FastAPI(title="P2P Downloader", description="A personal magnet link downloader")
+app = FastAPI(title="P2P Downloader", description="A personal magnet link downloader",
+              default_response_class=ORJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -73,6 +86,10 @@ else:
 
 # Store active downloads
 active_downloads = {}  # handle_id -> {"handle": lt.torrent_handle, "info": {...}}
+handle_to_id = {}  # lt.torrent_handle -> handle_id
+seeding_ids = set()  # handle_ids of torrents that have finished downloading
+SEED_CHECK_TICKS = 10  # status ticks between seed-ratio checks
+IDLE_SEED_CHECK_INTERVAL = 30.0  # seconds between seed-ratio checks with no clients connected
 
 class MagnetLinkRequest(BaseModel):
     magnet_link: str
@@ -92,109 +109,267 @@ class DownloadInfo(BaseModel):
     save_path: str
 
 # Connection manager for WebSocket
+SEND_QUEUE_SIZE = 32  # frames buffered per client before it is disconnected
+SEND_TIMEOUT = 5.0  # seconds before a stuck client is disconnected
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # websocket -> (send queue, writer task)
+        self.active_connections: Dict[WebSocket, tuple] = {}
+        self.closing = set()  # Close tasks for dropped clients, kept referenced until done
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        # Broadcasts only carry changes, so start every client from a full snapshot
+        infos = [data["info"] for data in active_downloads.values()]
+        if infos:
+            queue.put_nowait(orjson.dumps({"type": "updates", "data": infos}))
+        task = asyncio.create_task(self.writer(websocket, queue))
+        self.active_connections[websocket] = (queue, task)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        entry = self.active_connections.pop(websocket, None)
+        if entry and entry[1] is not asyncio.current_task():
+            entry[1].cancel()
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+    async def close(self, websocket: WebSocket):
+        """Close a dropped client's socket so the browser notices and reconnects"""
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    async def writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued payloads to a single client so it can't hold up the others"""
+        while True:
+            payload = await queue.get()
             try:
-                await connection.send_json(message)
+                await asyncio.wait_for(websocket.send_bytes(payload), timeout=SEND_TIMEOUT)
             except Exception as e:
-                logger.error(f"Failed to broadcast message: {e}")
+                logger.error(f"Failed to send message to client: {e}")
+                self.disconnect(websocket)
+                await self.close(websocket)
+                return
+
+    def broadcast(self, message: dict):
+        # Serialize once and hand the same payload to every client's queue
+        payload = orjson.dumps(message)
+        slow_clients = []
+        for websocket, (queue, _) in self.active_connections.items():
+            if queue.full():
+                slow_clients.append(websocket)
+            else:
+                queue.put_nowait(payload)
+        
+        # Frames are deltas and can't be dropped, so make clients that fell
+        # behind reconnect and start over from a fresh snapshot
+        for websocket in slow_clients:
+            logger.warning("Client fell too far behind, disconnecting")
+            self.disconnect(websocket)
+            task = asyncio.create_task(self.close(websocket))
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
 
 manager = ConnectionManager()
 
-def get_download_info(handle_id: str, handle) -> DownloadInfo:
-    """Get download information from a torrent handle"""
+# Thresholds below which a torrent update is treated as steady-state noise
+PROGRESS_EPSILON = 0.1  # percent
+SPEED_THRESHOLD = 1024  # bytes/s
+BROADCAST_INTERVAL = 1.0  # seconds between flushes of pending updates
+
+# Updates waiting to be flushed to clients, and the last info sent per download
+pending_updates: Dict[str, dict] = {}  # handle_id -> info
+last_broadcast: Dict[str, dict] = {}  # handle_id -> copy of info as last queued
+
+def has_material_change(handle_id: str, info: dict) -> bool:
+    """Check whether info differs enough from the last broadcast to be worth sending"""
+    prev = last_broadcast.get(handle_id)
+    if prev is None:
+        return True
+    if prev == info:
+        return False
+    # Thresholds only filter jitter; reaching a resting value (speed dropping
+    # to 0, ETA appearing or disappearing, completion) always goes out
+    return (
+        prev["status"] != info["status"]
+        or prev["name"] != info["name"]
+        or prev["num_peers"] != info["num_peers"]
+        or prev["total_size"] != info["total_size"]
+        or (prev["remaining_time"] is None) != (info["remaining_time"] is None)
+        or (prev["download_speed"] == 0) != (info["download_speed"] == 0)
+        or (prev["upload_speed"] == 0) != (info["upload_speed"] == 0)
+        or (prev["progress"] >= 100) != (info["progress"] >= 100)
+        or abs(info["progress"] - prev["progress"]) > PROGRESS_EPSILON
+        or abs(info["download_speed"] - prev["download_speed"]) > SPEED_THRESHOLD
+        or abs(info["upload_speed"] - prev["upload_speed"]) > SPEED_THRESHOLD
+    )
+
+def queue_update(handle_id: str, info: dict):
+    """Queue info for the next broadcast if it changed materially"""
+    if has_material_change(handle_id, info):
+        pending_updates[handle_id] = info
+        # info is updated in place, so keep a copy to diff the next poll against
+        last_broadcast[handle_id] = dict(info)
+
+def flush_updates():
+    """Send all pending updates to clients as a single frame"""
+    if not pending_updates:
+        return
+    updates = list(pending_updates.values())
+    pending_updates.clear()
+    manager.broadcast({"type": "updates", "data": updates})
+
+# Poll quickly while something is moving, back off once everything is idle
+ACTIVE_POLL_INTERVAL = 0.5  # seconds
+IDLE_POLL_INTERVAL = 5.0  # seconds
+NO_CLIENT_POLL_INTERVAL = 2.0  # seconds between checks for a connected client
+ACTIVE_STATES = {"metadata", "downloading", "checking", "checking resume"}
+
+def next_poll_interval(infos: List[dict]) -> float:
+    """Pick the next polling interval from the aggregate torrent state"""
+    if any(info["status"] in ACTIVE_STATES for info in infos):
+        return ACTIVE_POLL_INTERVAL
+    return IDLE_POLL_INTERVAL
+
+def forget_download(handle_id: str):
+    """Drop broadcast bookkeeping for a download that is no longer tracked"""
+    pending_updates.pop(handle_id, None)
+    last_broadcast.pop(handle_id, None)
+
+def get_download_info(handle_id: str, handle, status, info=None) -> DownloadInfo:
+    """Get download information from an already-fetched torrent status,
+    updating info in place when given"""
     if not handle or not handle.is_valid():
         return None
     
-    status = handle.status()
+    if info is None:
+        info = {"id": handle_id}
     
     if not status.has_metadata:
-        info = {"id": handle_id,
-                "name": "Fetching Metadata...",
-                "status": "metadata",
-                "progress": 0,
-                "download_speed": 0,
-                "upload_speed": 0,
-                "num_peers": 0,
-                "total_size": 0,
-                "downloaded": 0,
-                "remaining_time": None,
-                "save_path": DOWNLOAD_DIR}
+        info["name"] = "Fetching Metadata..."
+        info["status"] = "metadata"
+        info["progress"] = 0
+        info["download_speed"] = 0
+        info["upload_speed"] = 0
+        info["num_peers"] = 0
+        info["total_size"] = 0
+        info["downloaded"] = 0
+        info["remaining_time"] = None
+        info["save_path"] = DOWNLOAD_DIR
     else:
-        if lt:
-            state_str = {
-                lt.torrent_status.seeding: "seeding",
-                lt.torrent_status.downloading: "downloading",
-                lt.torrent_status.finished: "finished",
-                lt.torrent_status.checking_files: "checking",
-                lt.torrent_status.checking_resume_data: "checking resume",
-            }.get(status.state, "unknown")
-        else:
-            # Fallback status mapping without libtorrent constants
-            state_str = "unknown"
-        
         # Calculate remaining time
         remaining = None
         if status.download_rate > 0:
             remaining = int((status.total_wanted - status.total_wanted_done) / status.download_rate)
         
-        info = {
-            "id": handle_id,
-            "name": handle.name() if handle.has_metadata() else "Unknown",
-            "status": state_str,
-            "progress": status.progress * 100,
-            "download_speed": status.download_rate,
-            "upload_speed": status.upload_rate,
-            "num_peers": status.num_peers,
-            "total_size": status.total_wanted,
-            "downloaded": status.total_wanted_done,
-            "remaining_time": remaining,
-            "save_path": status.save_path
-        }
+        info["name"] = status.name or "Unknown"
+        info["status"] = STATE_NAMES.get(status.state, "unknown")
+        info["progress"] = status.progress * 100
+        info["download_speed"] = status.download_rate
+        info["upload_speed"] = status.upload_rate
+        info["num_peers"] = status.num_peers
+        info["total_size"] = status.total_wanted
+        info["downloaded"] = status.total_wanted_done
+        info["remaining_time"] = remaining
+        info["save_path"] = status.save_path
+    
+    if is_paused(status):
+        info["status"] = "paused"
     
     return info
 
+def poll_changed_statuses() -> List:
+    """Collect torrent statuses that changed since the previous poll"""
+    if not session:
+        return []
+    
+    # post_torrent_updates() answers asynchronously, so pop the snapshot
+    # requested on the previous tick before asking for the next one
+    statuses = []
+    for alert in session.pop_alerts():
+        if isinstance(alert, lt.state_update_alert):
+            statuses.extend(alert.status)
+    session.post_torrent_updates()
+    return statuses
+
+def remove_seeded_torrents():
+    """Remove completed torrents from the session once they have seeded enough"""
+    # Collect first so neither dict nor set is mutated while being iterated
+    to_remove: List[str] = []
+    for handle_id in seeding_ids:
+        data = active_downloads.get(handle_id)
+        if data is None or data["status"].all_time_upload > 2 * data["status"].total_wanted:
+            to_remove.append(handle_id)
+    
+    for handle_id in to_remove:
+        seeding_ids.discard(handle_id)
+        data = active_downloads.pop(handle_id, None)
+        if data is None:
+            continue
+        handle = data["handle"]
+        logger.info(f"Torrent {handle.name()} has seeded enough, removing from session")
+        session.remove_torrent(handle)
+        handle_to_id.pop(handle, None)
+        forget_download(handle_id)
+
+def apply_status_updates():
+    """Refresh tracked downloads from the statuses that changed since the last poll"""
+    for status in poll_changed_statuses():
+        handle = status.handle
+        handle_id = handle_to_id.get(handle)
+        if handle_id is None or handle_id not in active_downloads:
+            continue
+            
+        data = active_downloads[handle_id]
+        info = get_download_info(handle_id, handle, status, data["info"])
+        if info:
+            data["status"] = status
+            queue_update(handle_id, info)
+            if status.is_seeding:
+                seeding_ids.add(handle_id)
+            else:
+                seeding_ids.discard(handle_id)
+
 # Background task for updating torrent status
 async def update_torrent_status():
+    last_flush = 0.0
+    last_idle_check = 0.0
+    tick = 0
     while True:
-        updates = []
-        for handle_id, data in list(active_downloads.items()):
-            handle = data["handle"]
-            if not handle.is_valid():
-                continue
-                
-            info = get_download_info(handle_id, handle)
-            if info:
-                data["info"] = info
-                updates.append(info)
-                
-                # Remove completed torrents after seeding
-                if session:
-                    status = handle.status()
-                    if status.is_seeding and status.all_time_upload > 2 * status.total_wanted:
-                        logger.info(f"Torrent {handle.name()} has seeded enough, removing from session")
-                        session.remove_torrent(handle)
-                        del active_downloads[handle_id]
+        if not manager.active_connections:
+            # Nobody is watching, so only keep seeding cleanup going on a slow cadence
+            if time.monotonic() - last_idle_check >= IDLE_SEED_CHECK_INTERVAL:
+                apply_status_updates()
+                remove_seeded_torrents()
+                last_idle_check = time.monotonic()
+            await asyncio.sleep(NO_CLIENT_POLL_INTERVAL)
+            continue
         
-        if updates:
-            await manager.broadcast({"type": "updates", "data": updates})
+        tick += 1
+        apply_status_updates()
         
-        await asyncio.sleep(1)
+        if pending_updates and time.monotonic() - last_flush >= BROADCAST_INTERVAL:
+            flush_updates()
+            last_flush = time.monotonic()
+        
+        if tick % SEED_CHECK_TICKS == 0:
+            remove_seeded_torrents()
+        
+        infos = [data["info"] for data in active_downloads.values()]
+        interval = next_poll_interval(infos)
+        if pending_updates:
+            # Don't let the idle back-off hold queued updates past the next flush
+            interval = min(interval, max(0.0, BROADCAST_INTERVAL - (time.monotonic() - last_flush)))
+        await asyncio.sleep(interval)
 
 @app.on_event("startup")
 async def startup_event():
+    if session:
+        # Only status updates are consumed, so keep the alert queue small
+        session.apply_settings({
+            "alert_mask": lt.alert.category_t.status_notification | lt.alert.category_t.error_notification
+        })
     asyncio.create_task(update_torrent_status())
 
 @app.post("/api/download", response_model=Dict)
@@ -213,6 +388,7 @@ async def start_download(request: MagnetLinkRequest):
         
         # Generate unique ID for this download
         handle_id = str(uuid.uuid4())
+        handle_to_id[handle] = handle_id
         
         # Add to active downloads
         active_downloads[handle_id] = {
@@ -257,6 +433,9 @@ async def cancel_download(download_id: str):
     handle = active_downloads[download_id]["handle"]
     session.remove_torrent(handle, lt.session.delete_files)
     del active_downloads[download_id]
+    handle_to_id.pop(handle, None)
+    seeding_ids.discard(download_id)
+    forget_download(download_id)
     
     return {"success": True, "message": "Download canceled"}
 
@@ -280,30 +459,74 @@ async def resume_download(download_id: str):
     
     return {"success": True, "message": "Download resumed"}
 
-@app.get("/api/files", response_model=List[Dict])
-async def list_downloaded_files():
+# Cached JSON body for /api/files, rebuilt when the download dir changes or the TTL expires
+FILES_CACHE_TTL = 2.0  # seconds
+files_cache = {"mtime": None, "expires": 0.0, "body": b"[]"}
+files_cache_lock = asyncio.Lock()  # Lets concurrent requests share one rebuild
+
+def scan_downloaded_files() -> List[dict]:
+    """Walk DOWNLOAD_DIR with scandir, taking a single stat per file"""
     files = []
-    for root, _, filenames in os.walk(DOWNLOAD_DIR):
-        for filename in filenames:
-            file_path = os.path.join(root, filename)
-            rel_path = os.path.relpath(file_path, DOWNLOAD_DIR)
-            size = os.path.getsize(file_path)
-            files.append({
-                "name": filename,
-                "path": rel_path,
-                "size": size,
-                "created": os.path.getctime(file_path)
-            })
+    pending_dirs = [DOWNLOAD_DIR]
+    while pending_dirs:
+        # Like os.walk, skip directories and files that vanish or can't be read
+        # mid-scan, e.g. while a cancelled download is being deleted
+        try:
+            entries = os.scandir(pending_dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    entry_stat = entry.stat()
+                except OSError:
+                    continue
+                files.append({
+                    "name": entry.name,
+                    "path": os.path.relpath(entry.path, DOWNLOAD_DIR),
+                    "size": entry_stat.st_size,
+                    "created": entry_stat.st_ctime
+                })
     
     return files
 
+def list_files_sync() -> bytes:
+    """Scan DOWNLOAD_DIR and encode the listing; runs in a worker thread"""
+    return orjson.dumps(scan_downloaded_files())
+
+@app.get("/api/files", response_model=List[Dict])
+async def list_downloaded_files():
+    async with files_cache_lock:
+        now = time.monotonic()
+        mtime = os.stat(DOWNLOAD_DIR).st_mtime_ns
+        if files_cache["mtime"] != mtime or now >= files_cache["expires"]:
+            files_cache["body"] = await asyncio.to_thread(list_files_sync)
+            files_cache["mtime"] = mtime
+            files_cache["expires"] = time.monotonic() + FILES_CACHE_TTL
+    
+    return Response(content=files_cache["body"], media_type="application/json")
+
+class LargeFileResponse(FileResponse):
+    """FileResponse that streams torrent payloads in 1 MiB chunks"""
+    chunk_size = 1024 * 1024
+
 @app.get("/api/download/file/{path:path}")
 async def download_file(path: str):
     file_path = os.path.join(DOWNLOAD_DIR, path)
-    if not os.path.exists(file_path) or not os.path.isfile(file_path):
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(file_path, filename=os.path.basename(file_path))
+    # Pass the stat along so the response doesn't stat the file again
+    return LargeFileResponse(file_path, filename=os.path.basename(file_path), stat_result=stat_result)
 
 @app.get("/health")
 async def health_check():
@@ -323,11 +546,30 @@ async def websocket_endpoint(websocket: WebSocket):
             # We can implement commands here if needed
             await websocket.send_json({"message": "Received"})
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Prune on any exit so dead sockets never linger in the broadcast set
         manager.disconnect(websocket)
 
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers cache assets while always revalidating HTML"""
+    ASSET_MAX_AGE = 3600  # seconds; asset names aren't content-hashed, so keep this short
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            # "/" resolves to path "."; 304s carry no content type, so check both
+            if response.media_type == "text/html" or path in (".", "") or path.endswith(".html"):
+                response.headers["Cache-Control"] = "no-cache"
+            else:
+                response.headers["Cache-Control"] = f"public, max-age={self.ASSET_MAX_AGE}"
+        return response
+
 # Mount static files
-app.mount("/", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "..", "frontend"), html=True), name="static")
+app.mount("/", CachedStaticFiles(directory=os.path.join(os.path.dirname(__file__), "..", "frontend"), html=True), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    is_production = os.getenv("ENVIRONMENT", "development") == "production"
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                reload=not is_production, access_log=not is_production)
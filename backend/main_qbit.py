@@ -1,13 +1,15 @@
 import os
+import stat
 import uuid
 import json
 import logging
 import time
 import asyncio
+import orjson
 from typing import Dict, List, Optional, Union
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import qbittorrentapi
@@ -23,7 +25,8 @@ if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
 
 # Initialize FastAPI
-app = FastAPI(title="P2P Downloader", description="A personal magnet link downloader")
+app = FastAPI(title="P2P Downloader", description="A personal magnet link downloader",
+              default_response_class=ORJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -61,29 +64,136 @@ class DownloadInfo(BaseModel):
     save_path: str
 
 # Connection manager for WebSocket
+SEND_QUEUE_SIZE = 32  # frames buffered per client before it is disconnected
+SEND_TIMEOUT = 5.0  # seconds before a stuck client is disconnected
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # websocket -> (send queue, writer task)
+        self.active_connections: Dict[WebSocket, tuple] = {}
+        self.closing = set()  # Close tasks for dropped clients, kept referenced until done
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        # Broadcasts only carry changes, so start every client from a full snapshot
+        infos = [data["info"] for data in active_downloads.values()]
+        if infos:
+            queue.put_nowait(orjson.dumps({"type": "updates", "data": infos}))
+        task = asyncio.create_task(self.writer(websocket, queue))
+        self.active_connections[websocket] = (queue, task)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        entry = self.active_connections.pop(websocket, None)
+        if entry and entry[1] is not asyncio.current_task():
+            entry[1].cancel()
+
+    async def close(self, websocket: WebSocket):
+        """Close a dropped client's socket so the browser notices and reconnects"""
+        try:
+            await websocket.close()
+        except Exception:
+            pass
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+    async def writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued payloads to a single client so it can't hold up the others"""
+        while True:
+            payload = await queue.get()
             try:
-                await connection.send_json(message)
+                await asyncio.wait_for(websocket.send_bytes(payload), timeout=SEND_TIMEOUT)
             except Exception as e:
-                logger.error(f"Failed to broadcast message: {e}")
+                logger.error(f"Failed to send message to client: {e}")
+                self.disconnect(websocket)
+                await self.close(websocket)
+                return
+
+    def broadcast(self, message: dict):
+        # Serialize once and hand the same payload to every client's queue
+        payload = orjson.dumps(message)
+        slow_clients = []
+        for websocket, (queue, _) in self.active_connections.items():
+            if queue.full():
+                slow_clients.append(websocket)
+            else:
+                queue.put_nowait(payload)
+        
+        # Frames are deltas and can't be dropped, so make clients that fell
+        # behind reconnect and start over from a fresh snapshot
+        for websocket in slow_clients:
+            logger.warning("Client fell too far behind, disconnecting")
+            self.disconnect(websocket)
+            task = asyncio.create_task(self.close(websocket))
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
 
 manager = ConnectionManager()
 
-def get_download_info(handle_id: str, torrent_hash: str) -> DownloadInfo:
-    """Get download information from a torrent hash"""
+# Thresholds below which a torrent update is treated as steady-state noise
+PROGRESS_EPSILON = 0.1  # percent
+SPEED_THRESHOLD = 1024  # bytes/s
+BROADCAST_INTERVAL = 1.0  # seconds between flushes of pending updates
+
+# Updates waiting to be flushed to clients, and the last info sent per download
+pending_updates: Dict[str, dict] = {}  # handle_id -> info
+last_broadcast: Dict[str, dict] = {}  # handle_id -> copy of info as last queued
+
+def has_material_change(handle_id: str, info: dict) -> bool:
+    """Check whether info differs enough from the last broadcast to be worth sending"""
+    prev = last_broadcast.get(handle_id)
+    if prev is None:
+        return True
+    if prev == info:
+        return False
+    # Thresholds only filter jitter; reaching a resting value (speed dropping
+    # to 0, ETA appearing or disappearing, completion) always goes out
+    return (
+        prev["status"] != info["status"]
+        or prev["name"] != info["name"]
+        or prev["num_peers"] != info["num_peers"]
+        or prev["total_size"] != info["total_size"]
+        or (prev["remaining_time"] is None) != (info["remaining_time"] is None)
+        or (prev["download_speed"] == 0) != (info["download_speed"] == 0)
+        or (prev["upload_speed"] == 0) != (info["upload_speed"] == 0)
+        or (prev["progress"] >= 100) != (info["progress"] >= 100)
+        or abs(info["progress"] - prev["progress"]) > PROGRESS_EPSILON
+        or abs(info["download_speed"] - prev["download_speed"]) > SPEED_THRESHOLD
+        or abs(info["upload_speed"] - prev["upload_speed"]) > SPEED_THRESHOLD
+    )
+
+def queue_update(handle_id: str, info: dict):
+    """Queue info for the next broadcast if it changed materially"""
+    if has_material_change(handle_id, info):
+        pending_updates[handle_id] = info
+        # info is updated in place, so keep a copy to diff the next poll against
+        last_broadcast[handle_id] = dict(info)
+
+def flush_updates():
+    """Send all pending updates to clients as a single frame"""
+    if not pending_updates:
+        return
+    updates = list(pending_updates.values())
+    pending_updates.clear()
+    manager.broadcast({"type": "updates", "data": updates})
+
+# Poll quickly while something is moving, back off once everything is idle
+ACTIVE_POLL_INTERVAL = 0.5  # seconds
+IDLE_POLL_INTERVAL = 5.0  # seconds
+NO_CLIENT_POLL_INTERVAL = 2.0  # seconds between checks for a connected client
+ACTIVE_STATES = {"metadata", "downloading", "checking", "checking resume"}
+
+def next_poll_interval(infos: List[dict]) -> float:
+    """Pick the next polling interval from the aggregate torrent state"""
+    if any(info["status"] in ACTIVE_STATES for info in infos):
+        return ACTIVE_POLL_INTERVAL
+    return IDLE_POLL_INTERVAL
+
+def forget_download(handle_id: str):
+    """Drop broadcast bookkeeping for a download that is no longer tracked"""
+    pending_updates.pop(handle_id, None)
+    last_broadcast.pop(handle_id, None)
+
+def get_download_info(handle_id: str, torrent_hash: str, info=None) -> DownloadInfo:
+    """Get download information from a torrent hash, updating info in place when given"""
     try:
         torrent = qbt_client.torrents_info(torrent_hashes=torrent_hash)[0]
         
@@ -103,19 +213,18 @@ def get_download_info(handle_id: str, torrent_hash: str) -> DownloadInfo:
         # Calculate remaining time
         remaining = torrent.eta if torrent.eta > 0 else None
         
-        info = {
-            "id": handle_id,
-            "name": torrent.name,
-            "status": state_str,
-            "progress": torrent.progress * 100,
-            "download_speed": torrent.dlspeed,
-            "upload_speed": torrent.upspeed,
-            "num_peers": torrent.num_leechs + torrent.num_seeds,
-            "total_size": torrent.size,
-            "downloaded": int(torrent.size * torrent.progress / 100),
-            "remaining_time": remaining,
-            "save_path": torrent.save_path
-        }
+        if info is None:
+            info = {"id": handle_id}
+        info["name"] = torrent.name
+        info["status"] = state_str
+        info["progress"] = torrent.progress * 100
+        info["download_speed"] = torrent.dlspeed
+        info["upload_speed"] = torrent.upspeed
+        info["num_peers"] = torrent.num_leechs + torrent.num_seeds
+        info["total_size"] = torrent.size
+        info["downloaded"] = int(torrent.size * torrent.progress / 100)
+        info["remaining_time"] = remaining
+        info["save_path"] = torrent.save_path
         return info
     except Exception as e:
         logger.error(f"Error getting download info: {e}")
@@ -123,25 +232,44 @@ def get_download_info(handle_id: str, torrent_hash: str) -> DownloadInfo:
 
 # Background task for updating torrent status
 async def update_torrent_status():
+    last_flush = 0.0
     while True:
         try:
-            updates = []
-            for handle_id, data in list(active_downloads.items()):
+            if not manager.active_connections:
+                # Nobody is watching, so skip querying qBittorrent entirely
+                await asyncio.sleep(NO_CLIENT_POLL_INTERVAL)
+                continue
+            
+            infos = []
+            snapshot = tuple(active_downloads.items())
+            for handle_id, data in snapshot:
                 torrent_hash = data["hash"]
                 
-                info = get_download_info(handle_id, torrent_hash)
+                info = get_download_info(handle_id, torrent_hash, data["info"])
                 if info:
-                    data["info"] = info
-                    updates.append(info)
+                    infos.append(info)
+                    queue_update(handle_id, info)
             
-            if updates:
-                await manager.broadcast({"type": "updates", "data": updates})
+            if pending_updates and time.monotonic() - last_flush >= BROADCAST_INTERVAL:
+                flush_updates()
+                last_flush = time.monotonic()
             
-            await asyncio.sleep(1)
+            interval = next_poll_interval(infos)
+            if pending_updates:
+                # Don't let the idle back-off hold queued updates past the next flush
+                interval = min(interval, max(0.0, BROADCAST_INTERVAL - (time.monotonic() - last_flush)))
+            await asyncio.sleep(interval)
         except Exception as e:
             logger.error(f"Error in update_torrent_status: {e}")
             await asyncio.sleep(5)  # Wait a bit longer if there was an error
 
+async def simulate_mock_progress(client):
+    """Advance all mock torrents once per second"""
+    while True:
+        await asyncio.sleep(1)
+        for torrent in list(client.mock_torrents.values()):
+            torrent.advance()
+
 def initialize_qbittorrent():
     """Initialize the qBittorrent client and create a local qbittorrent instance for testing"""
     global qbt_client
@@ -207,18 +335,18 @@ def initialize_qbittorrent():
                 self.eta = 3600  # 1 hour
                 self.save_path = DOWNLOAD_DIR
                 
-                # Start progress simulation
-                asyncio.create_task(self.simulate_progress())
-                
-            async def simulate_progress(self):
-                while self.progress < 100:
-                    await asyncio.sleep(1)
-                    if not self.state_enum.is_paused:
-                        self.progress += 0.5
-                        self.dlspeed = 500000 + (hash(self.name) % 500000)  # Random speed
-                        self.num_seeds = 5 + (hash(self.name) % 10)
-                        self.num_leechs = 3 + (hash(self.name) % 7)
-                        self.eta = int((100 - self.progress) * 36)  # Decreasing time
+            def advance(self):
+                """Advance the simulated download by one second"""
+                if self.state_enum.is_complete:
+                    return
+                if not self.state_enum.is_paused:
+                    self.progress += 0.5
+                    self.dlspeed = 500000 + (hash(self.name) % 500000)  # Random speed
+                    self.num_seeds = 5 + (hash(self.name) % 10)
+                    self.num_leechs = 3 + (hash(self.name) % 7)
+                    self.eta = int((100 - self.progress) * 36)  # Decreasing time
+                if self.progress < 100:
+                    return
                 
                 self.state_enum.is_downloading = False
                 self.state_enum.is_complete = True
@@ -235,6 +363,8 @@ def initialize_qbittorrent():
                 self.is_paused = False
         
         qbt_client = MockClient()
+        # A single ticker drives every mock torrent instead of one task each
+        asyncio.create_task(simulate_mock_progress(qbt_client))
         logger.info("Mock qBittorrent client initialized successfully")
         return True
         
@@ -303,6 +433,7 @@ async def cancel_download(download_id: str):
     torrent_hash = active_downloads[download_id]["hash"]
     qbt_client.torrents_delete(torrent_hashes=torrent_hash, delete_files=True)
     del active_downloads[download_id]
+    forget_download(download_id)
     
     return {"success": True, "message": "Download canceled"}
 
@@ -326,30 +457,74 @@ async def resume_download(download_id: str):
     
     return {"success": True, "message": "Download resumed"}
 
-@app.get("/api/files", response_model=List[Dict])
-async def list_downloaded_files():
+# Cached JSON body for /api/files, rebuilt when the download dir changes or the TTL expires
+FILES_CACHE_TTL = 2.0  # seconds
+files_cache = {"mtime": None, "expires": 0.0, "body": b"[]"}
+files_cache_lock = asyncio.Lock()  # Lets concurrent requests share one rebuild
+
+def scan_downloaded_files() -> List[dict]:
+    """Walk DOWNLOAD_DIR with scandir, taking a single stat per file"""
     files = []
-    for root, _, filenames in os.walk(DOWNLOAD_DIR):
-        for filename in filenames:
-            file_path = os.path.join(root, filename)
-            rel_path = os.path.relpath(file_path, DOWNLOAD_DIR)
-            size = os.path.getsize(file_path)
-            files.append({
-                "name": filename,
-                "path": rel_path,
-                "size": size,
-                "created": os.path.getctime(file_path)
-            })
+    pending_dirs = [DOWNLOAD_DIR]
+    while pending_dirs:
+        # Like os.walk, skip directories and files that vanish or can't be read
+        # mid-scan, e.g. while a cancelled download is being deleted
+        try:
+            entries = os.scandir(pending_dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    entry_stat = entry.stat()
+                except OSError:
+                    continue
+                files.append({
+                    "name": entry.name,
+                    "path": os.path.relpath(entry.path, DOWNLOAD_DIR),
+                    "size": entry_stat.st_size,
+                    "created": entry_stat.st_ctime
+                })
     
     return files
 
+def list_files_sync() -> bytes:
+    """Scan DOWNLOAD_DIR and encode the listing; runs in a worker thread"""
+    return orjson.dumps(scan_downloaded_files())
+
+@app.get("/api/files", response_model=List[Dict])
+async def list_downloaded_files():
+    async with files_cache_lock:
+        now = time.monotonic()
+        mtime = os.stat(DOWNLOAD_DIR).st_mtime_ns
+        if files_cache["mtime"] != mtime or now >= files_cache["expires"]:
+            files_cache["body"] = await asyncio.to_thread(list_files_sync)
+            files_cache["mtime"] = mtime
+            files_cache["expires"] = time.monotonic() + FILES_CACHE_TTL
+    
+    return Response(content=files_cache["body"], media_type="application/json")
+
+class LargeFileResponse(FileResponse):
+    """FileResponse that streams torrent payloads in 1 MiB chunks"""
+    chunk_size = 1024 * 1024
+
 @app.get("/api/download/file/{path:path}")
 async def download_file(path: str):
     file_path = os.path.join(DOWNLOAD_DIR, path)
-    if not os.path.exists(file_path) or not os.path.isfile(file_path):
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(file_path, filename=os.path.basename(file_path))
+    # Pass the stat along so the response doesn't stat the file again
+    return LargeFileResponse(file_path, filename=os.path.basename(file_path), stat_result=stat_result)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -360,11 +535,30 @@ async def websocket_endpoint(websocket: WebSocket):
             # We can implement commands here if needed
             await websocket.send_json({"message": "Received"})
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Prune on any exit so dead sockets never linger in the broadcast set
         manager.disconnect(websocket)
 
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers cache assets while always revalidating HTML"""
+    ASSET_MAX_AGE = 3600  # seconds; asset names aren't content-hashed, so keep this short
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            # "/" resolves to path "."; 304s carry no content type, so check both
+            if response.media_type == "text/html" or path in (".", "") or path.endswith(".html"):
+                response.headers["Cache-Control"] = "no-cache"
+            else:
+                response.headers["Cache-Control"] = f"public, max-age={self.ASSET_MAX_AGE}"
+        return response
+
 # Mount static files
-app.mount("/", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "..", "frontend"), html=True), name="static")
+app.mount("/", CachedStaticFiles(directory=os.path.join(os.path.dirname(__file__), "..", "frontend"), html=True), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    is_production = os.getenv("ENVIRONMENT", "development") == "production"
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                reload=not is_production, access_log=not is_production)
@@ -54,6 +54,9 @@ document.addEventListener('DOMContentLoaded', () => {
         const wsUrl = `${protocol}//${window.location.host}/ws`;
         
         ws = new WebSocket(wsUrl);
+        // Receive binary frames as ArrayBuffers so they can be decoded synchronously, in order
+        ws.binaryType = 'arraybuffer';
+        const decoder = new TextDecoder();
         
         ws.onopen = () => {
             console.log('WebSocket connection established');
@@ -73,7 +76,9 @@ document.addEventListener('DOMContentLoaded', () => {
         };
         
         ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+            // Broadcasts arrive as pre-encoded binary frames
+            const raw = event.data instanceof ArrayBuffer ? decoder.decode(event.data) : event.data;
+            const data = JSON.parse(raw);
             
             if (data.type === 'updates' && Array.isArray(data.data)) {
                 data.data.forEach(updateDownload);
@@ -21,5 +21,6 @@ if __name__ == "__main__":
     
     logger.info(f"Starting P2P Downloader on {host}:{port}")
     
-    # Start the server
-    uvicorn.run("backend.main:app", host=host, port=port, reload=not is_production)
+    # Start the server (loop="auto" picks uvloop when it is installed)
+    uvicorn.run("backend.main:app", host=host, port=port, http="httptools", loop="auto",
+                reload=not is_production, access_log=not is_production)
@@ -15,7 +15,11 @@ if __name__ == "__main__":
     # Get host from environment variable or use default
     host = os.getenv("HOST", "0.0.0.0")
     
+    # Check if running in production (Docker)
+    is_production = os.getenv("ENVIRONMENT", "development") == "production"
+    
     logger.info(f"Starting P2P Downloader on {host}:{port}")
     
-    # Start the server using the qbit implementation
-    uvicorn.run("backend.main_qbit:app", host=host, port=port, reload=True)
+    # Start the server using the qbit implementation (loop="auto" picks uvloop when it is installed)
+    uvicorn.run("backend.main_qbit:app", host=host, port=port, http="httptools", loop="auto",
+                reload=not is_production, access_log=not is_production)